@@ -1,66 +1,260 @@
 import os
+import re
 import json
+import hashlib
 from flask import Flask, render_template, request, jsonify, redirect, url_for, send_from_directory
+from flask_compress import Compress
 from supabase import create_client, Client
 import pandas as pd
-from datetime import datetime
-import matplotlib.pyplot as plt
+import numpy as np
 import io
 import base64
+import threading
+import time
 import requests  # For calling Perplexity AI
 import matplotlib
 # Use 'Agg' backend for non-GUI environments like servers
 matplotlib.use('Agg')
+from matplotlib.figure import Figure
 
-app = Flask(__name__)
+# serve_static below handles /static itself, under the usual 'static' endpoint
+app = Flask(__name__, static_folder=None)
+# Brotli/gzip for HTML, JSON and the SVG charts; PNGs are already compressed
+# and are left alone.
+app.config['COMPRESS_ALGORITHM'] = ['br', 'gzip']
+app.config['COMPRESS_MIN_SIZE'] = 1024
+Compress(app)
 
 # --- Supabase Setup ---
 # Load from environment variables
 SUPABASE_URL = os.environ.get("SUPABASE_URL")
 SUPABASE_KEY = os.environ.get("SUPABASE_KEY")
 PERPLEXITY_API_KEY = os.environ.get("PERPLEXITY_API_KEY")
+# One session for all Perplexity calls, so they reuse a keep-alive connection
+_PERPLEXITY = requests.Session()
 
 if not SUPABASE_URL or not SUPABASE_KEY:
     print("Error: SUPABASE_URL and SUPABASE_KEY must be set in environment variables.")
 else:
     supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
 
+# --- Trade Cache ---
+# The trades table only changes through /upload, so page loads share one fetch.
+# DATA_VERSION is bumped on upload; the TTL bounds staleness across gunicorn
+# workers, which each hold their own copy of the cache.
+CACHE_TTL = 60
+DATA_VERSION = 0
+_CACHE = {"key": None, "trades": None, "fetched_at": 0.0}
+# Dashboard stats and chart URLs, keyed on the trade list they came from.
+_DASHBOARD = {"trades": None, "payload": None}
+PAGE_SIZE = 1000
+# Only what the dashboard charts and the analysis table read.
+TRADE_COLUMNS = ('id,instrument,strategy,entry_time,exit_time,profit,'
+                 'cum_net_profit,mae,mfe')
+
+
+def fetch_trades():
+    """Returns all trades (oldest first), served from cache when still valid."""
+    if (_CACHE["key"] == DATA_VERSION
+            and time.monotonic() - _CACHE["fetched_at"] < CACHE_TTL):
+        return _CACHE["trades"]
+
+    # PostgREST returns at most 1000 rows per request, so read in pages; id
+    # breaks exit_time ties so no row lands on two pages.
+    trades = []
+    while True:
+        page = supabase.table('trades').select(TRADE_COLUMNS).order(
+            'exit_time').order('id').range(
+            len(trades), len(trades) + PAGE_SIZE - 1).execute().data or []
+        trades.extend(page)
+        if len(page) < PAGE_SIZE:
+            break
+    _CACHE["key"] = DATA_VERSION
+    _CACHE["trades"] = trades
+    _CACHE["fetched_at"] = time.monotonic()
+    return _CACHE["trades"]
+
+
+def invalidate_cache():
+    """Drops cached trades so the next request re-reads Supabase."""
+    global DATA_VERSION
+    DATA_VERSION += 1
+    _CACHE["key"] = None
+    _CACHE["trades"] = None
+    _DASHBOARD["trades"] = None
+    _DASHBOARD["payload"] = None
+
+# --- CSV Helpers ---
+# NinjaTrader export columns stored in the trades table; the fee, ETD and
+# Bars columns (and the empty one from the trailing comma) are skipped.
+CSV_COLUMNS = [
+    'Trade number', 'Instrument', 'Account', 'Strategy', 'Market pos.', 'Qty',
+    'Entry price', 'Exit price', 'Entry time', 'Exit time', 'Entry name',
+    'Exit name', 'Profit', 'Cum. net profit', 'Commission', 'MAE', 'MFE',
+]
+CSV_DTYPES = {
+    'Instrument': str, 'Account': str, 'Strategy': str, 'Market pos.': str,
+    'Entry name': str, 'Exit name': str,
+}
+# NinjaTrader writes times like '2025-10-24 9:21:26 AM'.
+CSV_TIME_FORMAT = '%Y-%m-%d %I:%M:%S %p'
+_MONEY_CHARS = str.maketrans('', '', '$,')
+# Rows per insert request, keeping each PostgREST body small.
+INSERT_BATCH_SIZE = 500
+# Uploads are parsed this many rows at a time.
+CSV_CHUNK_ROWS = 10000
+
+
+def _to_num(series):
+    """Parses NinjaTrader money strings like '$1,234.50' into floats."""
+    if pd.api.types.is_numeric_dtype(series):
+        return series
+    cleaned = series.astype(str).str.translate(_MONEY_CHARS).str.strip()
+    return pd.to_numeric(cleaned, errors='coerce')
+
+
+def _parse_times(values):
+    """Parses NinjaTrader timestamps, falling back to inference for exports
+    written with a different locale."""
+    try:
+        return pd.to_datetime(values, format=CSV_TIME_FORMAT, cache=True)
+    except (ValueError, TypeError):
+        return pd.to_datetime(values, cache=True)
+
+
+def _upload_records(df):
+    """Cleans one chunk of a NinjaTrader export into Supabase insert rows."""
+    # --- Data Cleaning (based on NinjaTrader format) ---
+    # Rename columns to match Supabase (e.g., 'Trade number' -> 'trade_number')
+    df.columns = df.columns.str.lower().str.replace(' ', '_').str.replace('.', '')
+
+    # Ensure correct data types; times go to Supabase as ISO strings
+    for col in ['entry_time', 'exit_time']:
+        times = _parse_times(df[col])
+        df[col] = times.dt.strftime('%Y-%m-%dT%H:%M:%S')
+
+    # Handle 'Profit', 'Commission', 'MAE', 'MFE' (remove $, commas)
+    for col in ['profit', 'cum_net_profit', 'commission', 'mae', 'mfe']:
+        if col in df.columns:
+            df[col] = _to_num(df[col])
+
+    # Convert DataFrame to list of dicts for Supabase. to_dict already
+    # yields native Python numbers; only columns with gaps need their
+    # NaN/NaT swapped for None, which JSON can encode.
+    for col in df.columns[df.isna().any()]:
+        df[col] = df[col].astype(object).where(df[col].notna(), None)
+    return df.to_dict('records')
+
+
+def _profit_counts(profit):
+    """Returns (wins, losses, break_even) from one sign pass over a NaN-free
+    profit array."""
+    signs = np.sign(profit).astype(np.int64) + 1
+    losses, break_even, wins = np.bincount(signs, minlength=3)
+    return int(wins), int(losses), int(break_even)
+
 # --- Chart Generation Functions ---
+# Each chart redraws into one long-lived Figure instead of building a new one
+# per request; the lock keeps concurrent requests from sharing an Axes.
+_PROFIT_FIG = Figure(figsize=(10, 6), layout='tight')
+_PROFIT_AX = _PROFIT_FIG.add_subplot()
+_WIN_LOSS_FIG = Figure(figsize=(6, 6))
+_WIN_LOSS_AX = _WIN_LOSS_FIG.add_subplot()
+_CHART_LOCK = threading.Lock()
+# Charts are written as SVG: no rasterisation cost and crisp at any size.
+# Dropping the Date metadata keeps the output identical for identical data.
+SVG_OPTIONS = {'format': 'svg', 'metadata': {'Date': None}}
+
+
+# Each chart is saved as '<chart>_<data key>.svg', so a file name always maps
+# to the same bytes. An existing file means this data is already drawn, so
+# the render is skipped even after a restart or in another gunicorn worker,
+# and serve_static can cache the URL for a year.
+def _data_key(*parts):
+    """Short content hash of the values a chart is drawn from."""
+    digest = hashlib.blake2b(digest_size=8)
+    for part in parts:
+        if isinstance(part, (pd.Series, pd.DataFrame)):
+            part = pd.util.hash_pandas_object(part, index=False).to_numpy()
+            digest.update(part.tobytes())
+        else:
+            digest.update(repr(part).encode())
+    return digest.hexdigest()
 
 
-def generate_profit_curve(df, static_folder):
-    """Generates the cumulative profit curve chart."""
-    if 'cum_net_profit' not in df.columns or 'exit_time' not in df.columns:
-        return None
+CHART_FILE = re.compile(r'^[a-z_]+_[0-9a-f]{16}\.svg$')
 
-    # Ensure 'exit_time' is datetime and sorted
-    df['exit_time'] = pd.to_datetime(df['exit_time'])
-    df = df.sort_values(by='exit_time')
 
-    plt.figure(figsize=(10, 6))
-    plt.plot(df['exit_time'], df['cum_net_profit'],
-             label='Cumulative Profit', color='blue')
-    plt.title('Cumulative Profit Over Time')
-    plt.xlabel('Date')
-    plt.ylabel('Cumulative Profit ($)')
-    plt.grid(True)
-    plt.legend()
-    plt.tight_layout()
+def _chart_name(static_folder, chart, key):
+    """Returns the file name for chart at this data key, and whether it is
+    already on disk."""
+    filename = f'{chart}_{key}.svg'
+    return filename, os.path.exists(os.path.join(static_folder, filename))
 
-    chart_path = os.path.join(static_folder, 'profit_curve.png')
-    plt.savefig(chart_path)
-    plt.close()
-    # Add timestamp for cache-busting
-    return f'profit_curve.png?v={datetime.now().timestamp()}'
 
+def _save_chart(fig, static_folder, chart, filename):
+    # Written under a private name and renamed into place, so the chart
+    # file only appears once complete; os.replace is atomic on one file
+    # system, so readers and other workers never see a partial SVG.
+    path = os.path.join(static_folder, filename)
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    try:
+        fig.savefig(tmp_path, **SVG_OPTIONS)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    # Only the latest version of each chart is kept
+    for old in os.listdir(static_folder):
+        if (old != filename and old.startswith(chart + '_')
+                and CHART_FILE.match(old)):
+            try:
+                os.remove(os.path.join(static_folder, old))
+            except OSError:
+                pass
 
-def generate_win_loss_chart(df, static_folder):
+
+def generate_profit_curve(df, static_folder):
+    """Generates the cumulative profit curve chart."""
+    if 'cum_net_profit' not in df.columns or 'exit_time' not in df.columns:
+        return None
+
+    # Ensure 'exit_time' is datetime; fetch_trades already returns trades in
+    # exit order. Only the two plotted columns are copied; the caller's frame
+    # is left untouched.
+    df = df[['exit_time', 'cum_net_profit']]
+    df = df.assign(exit_time=pd.to_datetime(df['exit_time'], format='ISO8601'))
+
+    filename, current = _chart_name(
+        static_folder, 'profit_curve', _data_key(df))
+    if current:
+        return filename
+    with _CHART_LOCK:
+        ax = _PROFIT_AX
+        ax.clear()
+        ax.plot(df['exit_time'], df['cum_net_profit'],
+                label='Cumulative Profit', color='blue')
+        ax.set_title('Cumulative Profit Over Time')
+        ax.set_xlabel('Date')
+        ax.set_ylabel('Cumulative Profit ($)')
+        ax.grid(True)
+        ax.legend()
+        _save_chart(_PROFIT_FIG, static_folder, 'profit_curve', filename)
+    return filename
+
+
+def generate_win_loss_chart(df, static_folder, counts=None):
     """Generates the win/loss distribution pie chart."""
     if 'profit' not in df.columns:
         return None
 
-    wins = df[df['profit'] > 0].shape[0]
-    losses = df[df['profit'] <= 0].shape[0]
+    if counts is None:
+        profit = df['profit'].to_numpy(dtype=float)
+        counts = _profit_counts(profit[~np.isnan(profit)])
+    wins, losses, break_even = counts
+    # Break-even trades count as losses on the dashboard
+    losses += break_even
 
     if wins == 0 and losses == 0:
         return None
@@ -69,16 +263,19 @@ def generate_win_loss_chart(df, static_folder):
     sizes = [wins, losses]
     colors = ['#4CAF50', '#F44336']
 
-    plt.figure(figsize=(6, 6))
-    plt.pie(sizes, labels=labels, colors=colors,
-            autopct='%1.1f%%', startangle=90)
-    plt.title('Win/Loss Distribution')
-    plt.axis('equal')
-
-    chart_path = os.path.join(static_folder, 'win_loss.png')
-    plt.savefig(chart_path)
-    plt.close()
-    return f'win_loss.png?v={datetime.now().timestamp()}'
+    filename, current = _chart_name(
+        static_folder, 'win_loss', _data_key(wins, losses))
+    if current:
+        return filename
+    with _CHART_LOCK:
+        ax = _WIN_LOSS_AX
+        ax.clear()
+        ax.pie(sizes, labels=labels, colors=colors,
+               autopct='%1.1f%%', startangle=90)
+        ax.set_title('Win/Loss Distribution')
+        ax.axis('equal')
+        _save_chart(_WIN_LOSS_FIG, static_folder, 'win_loss', filename)
+    return filename
 
 # ... You can add your other chart functions here (profit_dist, strategy_profit, etc.) ...
 
@@ -121,53 +318,79 @@ def get_tone_prompt(tone_name):
     return tones.get(tone_name, tones['default'])
 
 
+# --- Dashboard Payload ---
+
+def dashboard_payload(trades):
+    """Returns (stats, charts) for the dashboard, reused until fetch_trades
+    hands back a different trade list (after an upload or the TTL)."""
+    if _DASHBOARD["trades"] is trades:
+        return _DASHBOARD["payload"]
+    payload = _build_dashboard(trades)
+    _DASHBOARD["trades"] = trades
+    _DASHBOARD["payload"] = payload
+    return payload
+
+
+def _build_dashboard(trades):
+    """Computes the dashboard stats and renders its charts."""
+    # Convert to DataFrame for analysis
+    df = pd.DataFrame(trades)
+
+    # --- Calculate Statistics (as per your README) ---
+    # Everything below works on the bare profit array; no filtered frames.
+    # Null profits still count as trades but are dropped once here, so they
+    # stay out of the averages and the win/loss counts, as they did in pandas.
+    profit = df['profit'].to_numpy(dtype=float)
+    total_trades = profit.size
+    profit = profit[~np.isnan(profit)]
+    counts = _profit_counts(profit)
+    wins = counts[0]
+    win_rate = (wins / total_trades) * 100 if total_trades > 0 else 0
+    total_profit = profit.sum()
+    avg_profit = total_profit / profit.size if profit.size else 0.0
+    # The losing side (break-even included) is whatever is left of the total
+    win_sum = np.where(profit > 0, profit, 0.0).sum()
+    non_wins = profit.size - wins
+    avg_win = win_sum / wins if wins else 0.0
+    avg_loss = (total_profit - win_sum) / non_wins if non_wins else 0.0
+    rr_ratio = abs(avg_win / avg_loss) if avg_loss != 0 else 0
+    expectancy = (win_rate / 100 * avg_win) - \
+        ((1 - win_rate / 100) * abs(avg_loss))
+
+    stats = {
+        'total_trades': total_trades,
+        'win_rate': f"{win_rate:.2f}%",
+        'total_profit': f"${total_profit:,.2f}",
+        'avg_profit': f"${avg_profit:,.2f}",
+        'rr_ratio': f"{rr_ratio:.2f}",
+        'expectancy': f"${expectancy:,.2f}"
+    }
+
+    # --- Generate Charts ---
+    static_folder = os.path.join(app.root_path, 'static')
+    charts = {
+        'profit_curve': generate_profit_curve(df, static_folder),
+        'win_loss': generate_win_loss_chart(df, static_folder, counts)
+        # Add other chart function calls here
+    }
+
+    return stats, charts
+
+
 # --- Flask Routes ---
 
 @app.route('/')
 def index():
     """Dashboard home page."""
     try:
-        # Get trades from Supabase
-        response = supabase.table('trades').select(
-            '*').order('exit_time', desc=True).execute()
-        trades = response.data
+        # Get trades from Supabase (cached between uploads)
+        trades = fetch_trades()
 
         if not trades:
             # Pass empty data to template
             return render_template('index.html', stats={}, charts={})
 
-        # Convert to DataFrame for analysis
-        df = pd.DataFrame(trades)
-
-        # --- Calculate Statistics (as per your README) ---
-        total_trades = df.shape[0]
-        wins = df[df['profit'] > 0].shape[0]
-        losses = total_trades - wins
-        win_rate = (wins / total_trades) * 100 if total_trades > 0 else 0
-        total_profit = df['profit'].sum()
-        avg_profit = df['profit'].mean()
-        avg_win = df[df['profit'] > 0]['profit'].mean()
-        avg_loss = df[df['profit'] <= 0]['profit'].mean()
-        rr_ratio = abs(avg_win / avg_loss) if avg_loss != 0 else 0
-        expectancy = (win_rate / 100 * avg_win) - \
-            ((1 - win_rate / 100) * abs(avg_loss))
-
-        stats = {
-            'total_trades': total_trades,
-            'win_rate': f"{win_rate:.2f}%",
-            'total_profit': f"${total_profit:,.2f}",
-            'avg_profit': f"${avg_profit:,.2f}",
-            'rr_ratio': f"{rr_ratio:.2f}",
-            'expectancy': f"${expectancy:,.2f}"
-        }
-
-        # --- Generate Charts ---
-        static_folder = os.path.join(app.root_path, 'static')
-        charts = {
-            'profit_curve': generate_profit_curve(df.copy(), static_folder),
-            'win_loss': generate_win_loss_chart(df.copy(), static_folder)
-            # Add other chart function calls here
-        }
+        stats, charts = dashboard_payload(trades)
 
         return render_template('index.html', stats=stats, charts=charts)
 
@@ -180,10 +403,8 @@ def index():
 def analysis_page():
     """Trade analysis page."""
     try:
-        # Fetch all trades for the analysis table
-        response = supabase.table('trades').select(
-            '*').order('exit_time', desc=True).execute()
-        trades = response.data
+        # Fetch all trades for the analysis table, newest at the top
+        trades = fetch_trades()[::-1]
         return render_template('analysis.html', trades=trades)
     except Exception as e:
         print(f"Error loading analysis page: {e}")
@@ -201,33 +422,25 @@ def upload_csv():
         return redirect(url_for('index', error='No file selected'))
 
     try:
-        # Read CSV data
-        df = pd.read_csv(file)
-
-        # --- Data Cleaning (based on NinjaTrader format) ---
-        # Rename columns to match Supabase (e.g., 'Trade number' -> 'trade_number')
-        df.columns = df.columns.str.lower().str.replace(' ', '_').str.replace('.', '')
-
-        # Ensure correct data types
-        df['entry_time'] = pd.to_datetime(df['entry_time'])
-        df['exit_time'] = pd.to_datetime(df['exit_time'])
-
-        # Handle 'Profit', 'Commission', 'MAE', 'MFE' (remove $, commas)
-        for col in ['profit', 'cum_net_profit', 'commission', 'mae', 'mfe']:
-            if col in df.columns:
-                df[col] = df[col].replace(
-                    r'[$,]', '', regex=True).astype(float)
-
-        # Convert DataFrame to list of dicts for Supabase
-        # Handle numpy types which are not JSON serializable
-        df = df.astype(object)  # Convert types for JSON
-        df = df.where(pd.notnull(df), None)  # Replace NaT/NaN with None
-        data_to_insert = df.to_dict('records')
-
-        # Insert data into Supabase
-        response = supabase.table('trades').insert(data_to_insert).execute()
-
-        if response.data:
+        # Read CSV data in chunks so a large export never sits in memory
+        # as a single frame
+        reader = pd.read_csv(file, usecols=lambda c: c in CSV_COLUMNS,
+                             dtype=CSV_DTYPES, chunksize=CSV_CHUNK_ROWS)
+
+        # Insert data into Supabase in bounded batches
+        inserted = 0
+        try:
+            for df in reader:
+                data_to_insert = _upload_records(df)
+                for start in range(0, len(data_to_insert), INSERT_BATCH_SIZE):
+                    response = supabase.table('trades').insert(
+                        data_to_insert[start:start + INSERT_BATCH_SIZE]).execute()
+                    inserted += len(response.data or [])
+        finally:
+            # Even a failed insert may have written rows, so always invalidate
+            invalidate_cache()
+
+        if inserted:
             return redirect(url_for('index'))
         else:
             return redirect(url_for('index', error='Failed to upload data.'))
@@ -304,8 +517,9 @@ def analyze_trades():
             ]
         }
 
-        response = requests.post(
-            "[https://api.perplexity.ai/chat/completions](https://api.perplexity.ai/chat/completions)", headers=headers, json=payload)
+        response = _PERPLEXITY.post(
+            "https://api.perplexity.ai/chat/completions", headers=headers,
+            json=payload, timeout=120)
 
         if response.status_code == 200:
             ai_response = response.json()
@@ -321,10 +535,15 @@ def analyze_trades():
 # --- Serve Static Chart Files ---
 
 
-@app.route('/static/<path:filename>')
+@app.route('/static/<path:filename>', endpoint='static')
 def serve_static(filename):
     """Serves static files (like generated charts)."""
-    return send_from_directory('static', filename)
+    # Chart files are named after their data key, so their bytes never change
+    # and they can be cached for a year. Everything is sent with an ETag and
+    # Last-Modified, so revalidation gets an empty 304.
+    chart_file = CHART_FILE.match(os.path.basename(filename))
+    max_age = 31536000 if chart_file else None
+    return send_from_directory('static', filename, max_age=max_age)
 
 
 # --- Main ---